@@ -1,9 +1,19 @@
 from .agent import (
     Agent,
     PromptAgent,
+    ReactPromptAgent,
     TeacherForcingAgent,
+    abatch_next_actions,
+    agenerate_responses,
     construct_agent,
-    ReactPromptAgent,
 )
 
-__all__ = ["Agent", "TeacherForcingAgent", "PromptAgent", "construct_agent", "ReactPromptAgent"]
+__all__ = [
+    "Agent",
+    "TeacherForcingAgent",
+    "PromptAgent",
+    "construct_agent",
+    "ReactPromptAgent",
+    "abatch_next_actions",
+    "agenerate_responses",
+]
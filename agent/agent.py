@@ -15,9 +15,11 @@ from browser_env.actions import (
     create_none_action,
     create_playwright_action,
 )
-from browser_env.utils import Observation, StateInfo
+from browser_env.utils import Observation, StateInfo, maybe_beartype
 from llms import lm_config
 from llms.providers.openai_utils import (
+    agenerate_from_openai_chat_completion,
+    agenerate_from_openai_completion,
     generate_from_openai_chat_completion,
     generate_from_openai_completion,
 )
@@ -79,7 +81,7 @@ class TeacherForcingAgent(Agent):
 
         self.actions: list[Action] = actions
 
-    @beartype
+    @maybe_beartype
     def next_action(
         self, trajectory: Trajectory, intent: str, meta_data: Any
     ) -> Action:
@@ -117,7 +119,7 @@ class PromptAgent(Agent):
     def set_action_set_tag(self, tag: str) -> None:
         self.action_set_tag = tag
 
-    @beartype
+    @maybe_beartype
     def next_action(
         self, trajectory: Trajectory, intent: str, meta_data: dict[str, Any]
     ) -> Action:
@@ -197,14 +199,7 @@ class ReactPromptAgent(Agent):
     ) -> None:
         with open(test_config_file) as f:
             _c = json.load(f)
-            intent_content = "OBJECTIVE:" + _c["intent"]
-            self.prompt_constructor.intent = [{"role": "system", "content": intent_content}]
-            self.prompt_constructor.intent_tokens = len(intent_content)/4
-        self.prompt_constructor.messages = []
-        self.prompt_constructor.messages_tokens_list = []
-        self.prompt_constructor.messages_token_sum = 0
-        self.prompt_constructor.msg_start_idx = 0
-
+        self.prompt_constructor.reset(_c["intent"])
 
     @beartype
     def set_action_set_tag(self, tag: str) -> None:
@@ -242,7 +237,7 @@ class ReactPromptAgent(Agent):
             )
         return response
 
-    @beartype
+    @maybe_beartype
     def next_action(
         self, trajectory: Trajectory, intent: str, meta_data: dict[str, Any]
     ) -> Action:
@@ -255,7 +250,10 @@ class ReactPromptAgent(Agent):
             trajectory, intent, meta_data
         )
 
-        response = self.get_response(thought_prompt)
+        response = self.prompt_constructor.cache_lookup(thought_prompt)
+        if response is None:
+            response = self.get_response(thought_prompt)
+            self.prompt_constructor.cache_store(thought_prompt, response)
         # thought_response = self.get_response(thought_prompt)
         # if not thought_response.lower().startswith('thought:'):
         #     thought_response = 'Thought: ' + thought_response
@@ -267,6 +265,10 @@ class ReactPromptAgent(Agent):
         # )
         # response = self.get_response(prompt)
 
+        return self.parse_response(response)
+
+    def parse_response(self, response: str) -> Action:
+        """Record the response in the history and parse it into an action"""
         self.prompt_constructor.remove_obs()
         self.prompt_constructor.add_message(response, "assistant")
 
@@ -293,6 +295,96 @@ class ReactPromptAgent(Agent):
     # def reset(self, test_config_file: str) -> None:
     #     pass
 
+
+async def agenerate_responses(
+    prompts: list[APIInput],
+    lm_config: lm_config.LMConfig,
+    max_concurrent_requests: int = 8,
+) -> list[str]:
+    """Query the LLM with the prompts concurrently"""
+    if lm_config.provider == "openai":
+        if lm_config.mode == "chat":
+            return await agenerate_from_openai_chat_completion(
+                messages_list=prompts,  # type: ignore[arg-type]
+                engine=lm_config.model,
+                temperature=lm_config.gen_config["temperature"],
+                max_tokens=lm_config.gen_config["max_tokens"],
+                top_p=lm_config.gen_config["top_p"],
+                context_length=lm_config.gen_config["context_length"],
+                max_concurrent_requests=max_concurrent_requests,
+                stop_token=None,
+                show_progress=False,
+            )
+        elif lm_config.mode == "completion":
+            return await agenerate_from_openai_completion(
+                prompts=prompts,  # type: ignore[arg-type]
+                engine=lm_config.model,
+                temperature=lm_config.gen_config["temperature"],
+                max_tokens=lm_config.gen_config["max_tokens"],
+                top_p=lm_config.gen_config["top_p"],
+                context_length=lm_config.gen_config["context_length"],
+                max_concurrent_requests=max_concurrent_requests,
+                stop_token=lm_config.gen_config["stop_token"],
+                show_progress=False,
+            )
+        else:
+            raise ValueError(
+                f"OpenAI models do not support mode {lm_config.mode}"
+            )
+    else:
+        raise NotImplementedError(
+            f"Provider {lm_config.provider} not implemented"
+        )
+
+
+async def abatch_next_actions(
+    agents: list[ReactPromptAgent],
+    trajectories: list[Trajectory],
+    intents: list[str],
+    meta_data_list: list[dict[str, Any]],
+    max_concurrent_requests: int = 8,
+) -> list[Action]:
+    """Predict the next action of several parallel trajectories at once
+
+    The LLM calls overlap instead of running one after another, so all
+    agents must share the same lm_config.
+    """
+    if not agents:
+        return []
+    lm_config = agents[0].lm_config
+    assert all(
+        agent.lm_config == lm_config for agent in agents
+    ), "Batched agents must share the same lm_config"
+    prompts = [
+        agent.prompt_constructor.construct_thought(  # type: ignore[attr-defined]
+            trajectory, intent, meta_data
+        )
+        for agent, trajectory, intent, meta_data in zip(
+            agents, trajectories, intents, meta_data_list
+        )
+    ]
+    responses = [
+        agent.prompt_constructor.cache_lookup(prompt)  # type: ignore[attr-defined]
+        for agent, prompt in zip(agents, prompts)
+    ]
+    misses = [i for i, response in enumerate(responses) if response is None]
+    if misses:
+        generated = await agenerate_responses(
+            [prompts[i] for i in misses],
+            lm_config,
+            max_concurrent_requests,
+        )
+        for i, response in zip(misses, generated):
+            responses[i] = response
+            agents[i].prompt_constructor.cache_store(  # type: ignore[attr-defined]
+                prompts[i], response
+            )
+    return [
+        agent.parse_response(response)
+        for agent, response in zip(agents, responses)
+    ]
+
+
 def construct_llm_config(args: argparse.Namespace) -> lm_config.LMConfig:
     llm_config = lm_config.LMConfig(
         provider=args.provider, model=args.model, mode=args.mode
@@ -304,6 +396,10 @@ def construct_llm_config(args: argparse.Namespace) -> lm_config.LMConfig:
         llm_config.gen_config["max_tokens"] = args.max_tokens
         llm_config.gen_config["stop_token"] = args.stop_token
         llm_config.gen_config["max_obs_length"] = args.max_obs_length
+        llm_config.gen_config["response_cache_path"] = args.response_cache_path
+        llm_config.gen_config[
+            "compress_history_after"
+        ] = args.compress_history_after
     else:
         raise NotImplementedError(f"provider {args.provider} not implemented")
     return llm_config
@@ -1,29 +1,49 @@
+import functools
+import hashlib
 import json
+import logging
 import re
+import sqlite3
+import string
+from collections import deque
+from collections.abc import Sequence
 from pathlib import Path
-from typing import Any, TypedDict
+from types import MappingProxyType
+from typing import Any, Iterable, TypedDict
 
 import tiktoken
-from beartype import beartype
 
 from browser_env import Action, ActionParsingError, Trajectory
 from browser_env.env_config import URL_MAPPINGS
-from browser_env.utils import StateInfo
+from browser_env.utils import StateInfo, maybe_beartype
 from llms import lm_config
 
 APIInput = str | list[Any] | dict[str, Any]
 
+logger = logging.getLogger(__name__)
+
+URL_MAPPINGS_TO_LOCAL = {j: i for i, j in URL_MAPPINGS.items()}
+
+
+def _compile_alternation(keys: Iterable[str]) -> re.Pattern[str]:
+    """Match any of the keys, preferring the longest one"""
+    ordered = sorted(keys, key=len, reverse=True)
+    return re.compile("|".join(re.escape(k) for k in ordered))
+
 
 class Instruction(TypedDict):
     """Instruction for constructing prompt"""
 
     intro: str
-    examples: list[tuple[str, str]]
+    examples: tuple[tuple[str, str], ...]
     template: str
     meta_data: dict[str, Any]
 
 
 class PromptConstructor(object):
+    _to_real_re = _compile_alternation(URL_MAPPINGS)
+    _to_local_re = _compile_alternation(URL_MAPPINGS_TO_LOCAL)
+
     def __init__(
         self,
         instruction_path: str | Path,
@@ -33,47 +53,138 @@ class PromptConstructor(object):
         self.instrction_path = Path(instruction_path)
         self.obs_modality = "text"
         self.lm_config = lm_config
-        instruction = json.load(open(self.instrction_path))
-        instruction["examples"] = [tuple(e) for e in instruction["examples"]]
+        instruction = self.load_instruction(self.instrction_path.resolve())
         self.instruction: Instruction = instruction
         self.tokenizer = tokenizer
+        # memoized per instance so a discarded constructor frees its cache
+        self.count_tokens = functools.lru_cache(maxsize=128)(
+            self._count_tokens
+        )
+        # the system message and few-shot examples never change, so the
+        # chat prefix is built once and shared by every prompt
+        self._chat_prefix = self.build_chat_prefix(
+            instruction["intro"], instruction["examples"]
+        )
+        self.intro = instruction["intro"]
+        self.examples = instruction["examples"]
+        self.template = instruction["template"]
+        self.keywords = tuple(instruction["meta_data"]["keywords"])
+        # make sure the template only uses the declared keywords
+        fields = {
+            field
+            for _, field, _, _ in string.Formatter().parse(self.template)
+            if field is not None
+        }
+        unknown = fields - set(self.keywords)
+        if unknown:
+            raise ValueError(
+                f"Template of {self.instrction_path} uses undeclared keywords "
+                f"{sorted(unknown)}"
+            )
+        meta_data = instruction["meta_data"]
+        action_splitter = re.escape(meta_data["action_splitter"])
+        self._action_re = re.compile(
+            rf"{action_splitter}(.*?){action_splitter}", re.DOTALL
+        )
+        # (raw, truncated) pair of the latest observation
+        self._last_obs: tuple[str, str] | None = None
+
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def load_instruction(path: Path) -> Instruction:
+        """Load the instruction file once and share it read-only"""
+        with open(path) as f:
+            instruction = json.load(f)
+        instruction["examples"] = tuple(
+            (x, y) for (x, y) in instruction["examples"]
+        )
+        instruction["meta_data"] = MappingProxyType(instruction["meta_data"])
+        return MappingProxyType(instruction)  # type: ignore[return-value]
+
+    @staticmethod
+    def build_chat_prefix(
+        intro: str, examples: Sequence[tuple[str, str]]
+    ) -> list[dict[str, str]]:
+        """Return the system and example messages of a chat prompt"""
+        message = [{"role": "system", "content": intro}]
+        for (x, y) in examples:
+            message.append(
+                {
+                    "role": "system",
+                    "name": "example_user",
+                    "content": x,
+                }
+            )
+            message.append(
+                {
+                    "role": "system",
+                    "name": "example_assistant",
+                    "content": y,
+                }
+            )
+        return message
 
-    @beartype
+    def _count_tokens(self, text: str) -> int:
+        """Return the exact number of tokens of the text"""
+        return len(self.tokenizer.encode_ordinary(text))
+
+    def encode_truncated(self, text: str, max_tokens: int) -> list[int]:
+        """Encode the text and keep at most the first `max_tokens` tokens
+
+        Special-token markers in web content are encoded as plain text.
+        Only a growing prefix of the text is encoded, so the cost depends
+        on the number of kept tokens rather than on the length of the text
+        """
+        prefix_length = max_tokens * 8
+        while prefix_length < len(text):
+            tokens = self.tokenizer.encode_ordinary(text[:prefix_length])
+            if len(tokens) > max_tokens:
+                return tokens[:max_tokens]
+            prefix_length *= 2
+        return self.tokenizer.encode_ordinary(text)[:max_tokens]
+
+    def truncate_observation(self, obs: str) -> str:
+        """Truncate the observation to `max_obs_length` tokens
+
+        Pages that have not finished loading often yield the same
+        observation several steps in a row, so the latest result is reused
+        """
+        max_obs_length = self.lm_config.gen_config["max_obs_length"]
+        if not max_obs_length:
+            return obs
+        if self._last_obs is not None and self._last_obs[0] == obs:
+            return self._last_obs[1]
+        truncated = self.tokenizer.decode(
+            self.encode_truncated(obs, max_obs_length)
+        )
+        self._last_obs = (obs, truncated)
+        return truncated
+
+    @maybe_beartype
     def get_lm_api_input(
-        self, intro: str, examples: list[tuple[str, str]], current: str
+        self, intro: str, examples: Sequence[tuple[str, str]], current: str
     ) -> APIInput:
 
         """Return the require format for an API"""
         message: list[dict[str, str]] | str
         if "openai" in self.lm_config.provider:
             if self.lm_config.mode == "chat":
-                message = [{"role": "system", "content": intro}]
-                for (x, y) in examples:
-                    message.append(
-                        {
-                            "role": "system",
-                            "name": "example_user",
-                            "content": x,
-                        }
-                    )
-                    message.append(
-                        {
-                            "role": "system",
-                            "name": "example_assistant",
-                            "content": y,
-                        }
-                    )
-                message.append({"role": "user", "content": current})
+                if intro == self.intro and tuple(examples) == self.examples:
+                    prefix = self._chat_prefix
+                else:
+                    prefix = self.build_chat_prefix(intro, examples)
+                message = prefix + [{"role": "user", "content": current}]
                 return message
             elif self.lm_config.mode == "completion":
-                message = f"{intro}\n\n"
-                message += "Here are a few examples:\n"
-                for example in examples:
-                    message += f"Observation\n:{example[0]}\n\n"
-                    message += f"Action: {example[1]}\n\n"
-                message += "Now make prediction given the observation\n\n"
-                message += f"Observation\n:{current}\n\n"
-                message += "Action:"
+                parts = [f"{intro}\n\n", "Here are a few examples:\n"]
+                parts.extend(
+                    f"Observation\n:{x}\n\nAction: {y}\n\n"
+                    for (x, y) in examples
+                )
+                parts.append("Now make prediction given the observation\n\n")
+                parts.append(f"Observation\n:{current}\n\n")
+                parts.append("Action:")
+                message = "".join(parts)
                 return message
             else:
                 raise ValueError(
@@ -84,7 +195,7 @@ class PromptConstructor(object):
                 f"Provider {self.lm_config.provider} not implemented"
             )
 
-    @beartype
+    @maybe_beartype
     def construct(
         self,
         trajectory: Trajectory,
@@ -93,27 +204,23 @@ class PromptConstructor(object):
     ) -> APIInput:
         raise NotImplementedError
 
-    @beartype
+    @maybe_beartype
     def map_url_to_real(self, url: str) -> str:
         """Map the urls to their real world counterparts"""
-        for i, j in URL_MAPPINGS.items():
-            if i in url:
-                url = url.replace(i, j)
-        return url
+        return self._to_real_re.sub(lambda m: URL_MAPPINGS[m.group(0)], url)
 
-    @beartype
+    @maybe_beartype
     def map_url_to_local(self, url: str) -> str:
         """Map the urls to their local counterparts"""
-        for i, j in URL_MAPPINGS.items():
-            if j in url:
-                url = url.replace(j, i)
-        return url
+        return self._to_local_re.sub(
+            lambda m: URL_MAPPINGS_TO_LOCAL[m.group(0)], url
+        )
 
-    @beartype
+    @maybe_beartype
     def _extract_action(self, response: str) -> str:
         raise NotImplementedError
 
-    @beartype
+    @maybe_beartype
     def extract_action(self, response: str) -> str:
         response = self._extract_action(response)
         response = self.map_url_to_local(response)
@@ -131,7 +238,7 @@ class DirectPromptConstructor(PromptConstructor):
     ):
         super().__init__(instruction_path, lm_config, tokenizer)
 
-    @beartype
+    @maybe_beartype
     def construct(
         self,
         trajectory: Trajectory,
@@ -139,16 +246,13 @@ class DirectPromptConstructor(PromptConstructor):
         meta_data: dict[str, Any] = {},
     ) -> APIInput:
         """Construct prompt given the trajectory"""
-        intro = self.instruction["intro"]
-        examples = self.instruction["examples"]
-        template = self.instruction["template"]
-        keywords = self.instruction["meta_data"]["keywords"]
+        intro = self.intro
+        examples = self.examples
+        template = self.template
         state_info: StateInfo = trajectory[-1]  # type: ignore[assignment]
 
         obs = state_info["observation"][self.obs_modality]
-        max_obs_length = self.lm_config.gen_config["max_obs_length"]
-        if max_obs_length:
-            obs = self.tokenizer.decode(self.tokenizer.encode(obs)[:max_obs_length])  # type: ignore[arg-type]
+        obs = self.truncate_observation(obs)  # type: ignore[arg-type]
 
         page = state_info["info"]["page"]
         url = page.url
@@ -162,16 +266,12 @@ class DirectPromptConstructor(PromptConstructor):
             previous_action=previous_action_str,
         )
 
-        # make sure all keywords are replaced
-        assert all([f"{{k}}" not in current for k in keywords])
         prompt = self.get_lm_api_input(intro, examples, current)
         return prompt
 
-    @beartype
+    @maybe_beartype
     def _extract_action(self, response: str) -> str:
-        action_splitter = self.instruction["meta_data"]["action_splitter"]
-        pattern = rf"{action_splitter}(.*?){action_splitter}"
-        match = re.search(pattern, response)
+        match = self._action_re.search(response)
         if match:
             return match.group(1)
         else:
@@ -192,23 +292,20 @@ class CoTPromptConstructor(PromptConstructor):
         super().__init__(instruction_path, lm_config, tokenizer)
         self.answer_phrase = self.instruction["meta_data"]["answer_phrase"]
 
-    @beartype
+    @maybe_beartype
     def construct(
         self,
         trajectory: Trajectory,
         intent: str,
         meta_data: dict[str, Any] = {},
     ) -> APIInput:
-        intro = self.instruction["intro"]
-        examples = self.instruction["examples"]
-        template = self.instruction["template"]
-        keywords = self.instruction["meta_data"]["keywords"]
+        intro = self.intro
+        examples = self.examples
+        template = self.template
         state_info: StateInfo = trajectory[-1]  # type: ignore[assignment]
 
         obs = state_info["observation"][self.obs_modality]
-        max_obs_length = self.lm_config.gen_config["max_obs_length"]
-        if max_obs_length:
-            obs = self.tokenizer.decode(self.tokenizer.encode(obs)[:max_obs_length])  # type: ignore[arg-type]
+        obs = self.truncate_observation(obs)  # type: ignore[arg-type]
 
         page = state_info["info"]["page"]
         url = page.url
@@ -220,17 +317,13 @@ class CoTPromptConstructor(PromptConstructor):
             previous_action=previous_action_str,
         )
 
-        assert all([f"{{k}}" not in current for k in keywords])
-
         prompt = self.get_lm_api_input(intro, examples, current)
         return prompt
 
-    @beartype
+    @maybe_beartype
     def _extract_action(self, response: str) -> str:
         # find the first occurence of action
-        action_splitter = self.instruction["meta_data"]["action_splitter"]
-        pattern = rf"{action_splitter}(.*?){action_splitter}"
-        match = re.search(pattern, response)
+        match = self._action_re.search(response)
         if match:
             return match.group(1)
         else:
@@ -239,7 +332,19 @@ class CoTPromptConstructor(PromptConstructor):
             )
 
 class ReactPromptConstructor(PromptConstructor):
-    """The agent will perform step-by-step reasoning before the answer"""
+    """The agent will perform step-by-step reasoning before the answer
+
+    The prompt is laid out as sys_prompt + intent + message history. The
+    system prompt and the intent must stay byte-identical for the whole
+    task so that the provider's prefix cache can reuse them; only the
+    message history changes from step to step.
+    """
+
+    # chat framing added by the API around every message and the reply,
+    # see the OpenAI cookbook on counting tokens for chat models
+    TOKENS_PER_MESSAGE = 4
+    TOKENS_PER_NAME = 1
+    REPLY_PRIMING_TOKENS = 3
 
     def __init__(
         self,
@@ -250,43 +355,110 @@ class ReactPromptConstructor(PromptConstructor):
         super().__init__(instruction_path, lm_config, tokenizer)
         self.answer_phrase = self.instruction["meta_data"]["answer_phrase"]
         self.sys_prompt = self.get_lm_api_initialize()
-        self.sys_tokens = sum([len(msg['content']) for msg in self.sys_prompt])/4
-        self.messages = []
-        self.messages_tokens_list = []
+        self.sys_tokens = sum(
+            self.count_message_tokens(msg) for msg in self.sys_prompt
+        )
+        self.messages: deque[dict[str, str]] = deque()
+        self.messages_tokens_list: deque[int] = deque()
         self.messages_token_sum = 0
-        self.intent = ""
+        self.objective: str | None = None
+        self.intent: list[dict[str, str]] = []
         self.intent_tokens = 0
-        self.msg_start_idx = 0
+        # sha256 of the prompt -> response, persisted across runs
+        self.response_cache: sqlite3.Connection | None = None
+        response_cache_path = lm_config.gen_config.get("response_cache_path")
+        if response_cache_path:
+            if lm_config.gen_config.get("temperature", 0) > 0:
+                logger.warning(
+                    "Replaying cached responses sampled at temperature %s",
+                    lm_config.gen_config["temperature"],
+                )
+            self.response_cache = self.open_response_cache(response_cache_path)
+        # responses older than this many steps lose their thoughts, 0 keeps
+        # the history verbatim
+        self.compress_after = lm_config.gen_config.get(
+            "compress_history_after", 0
+        )
+        # a thought that mentions "the previous action: ..." must not end it
+        self._thought_re = re.compile(r"Thought:.*?(?=\bAction:)", re.DOTALL)
+        # number of leading messages already checked for compression
+        self.n_compressed = 0
+
+    def count_message_tokens(self, msg: dict[str, str]) -> int:
+        """Return the tokens of a chat message, including its framing"""
+        tokens = self.TOKENS_PER_MESSAGE + self.count_tokens(msg["content"])
+        if "name" in msg:
+            tokens += self.TOKENS_PER_NAME
+        return tokens
+
+    def reset(self, intent: str) -> None:
+        """Start a new task, keeping the system prompt and the caches"""
+        self.messages.clear()
+        self.messages_tokens_list.clear()
+        self.messages_token_sum = 0
+        self.n_compressed = 0
+        self.set_intent(intent)
+
+    def set_intent(self, intent: str) -> None:
+        """Set the objective message that follows the system prompt"""
+        self.objective = intent
+        intent_content = "OBJECTIVE:" + intent
+        self.intent = [{"role": "system", "content": intent_content}]
+        self.intent_tokens = self.count_message_tokens(self.intent[0])
+
+    def cache_key(self, prompt: APIInput) -> str:
+        """Return a content hash of the prompt for the response cache"""
+        content = json.dumps([self.lm_config.model, prompt], sort_keys=True)
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    @staticmethod
+    def open_response_cache(path: str | Path) -> sqlite3.Connection:
+        """Open the response cache file, creating it on first use"""
+        connection = sqlite3.connect(path)
+        with connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses "
+                "(key TEXT PRIMARY KEY, response TEXT NOT NULL)"
+            )
+        return connection
+
+    def cache_lookup(self, prompt: APIInput) -> str | None:
+        """Return the cached response to an identical prompt, if any"""
+        if self.response_cache is None:
+            return None
+        row = self.response_cache.execute(
+            "SELECT response FROM responses WHERE key = ?",
+            (self.cache_key(prompt),),
+        ).fetchone()
+        return row[0] if row else None
+
+    def cache_store(self, prompt: APIInput, response: str) -> None:
+        """Cache the response, skipping the empty reply of a failed call"""
+        if self.response_cache is None or not response:
+            return
+        with self.response_cache:
+            self.response_cache.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?)",
+                (self.cache_key(prompt), response),
+            )
 
     def get_lm_api_initialize(self):
         """Return the required format for an API"""
         message: list[dict[str, str]] | str
         if "openai" in self.lm_config.provider:
             if self.lm_config.mode == "chat":
-                message = [{"role": "system", "content": self.instruction["intro"]}]
-                for (user_msg, assistant_msg) in self.instruction["examples"]:
-                    message.append(
-                        {
-                            "role": "system",
-                            "name": "example_user",
-                            "content": user_msg,
-                        }
-                    )
-                    message.append(
-                        {
-                            "role": "system",
-                            "name": "example_assistant",
-                            "content": assistant_msg,
-                        }
-                    )
-
+                message = list(self._chat_prefix)
                 return message
             elif self.lm_config.mode == "completion":
-                message = f"{self.instruction['intro']}\n\n"
-                message += "Here are a few examples:\n"
-                for example in self.instruction["examples"]:
-                    message += f"Observation\n:{example[0]}\n\n"
-                    message += f"Action: {example[1]}\n\n"
+                parts = [
+                    f"{self.intro}\n\n",
+                    "Here are a few examples:\n",
+                ]
+                parts.extend(
+                    f"Observation\n:{x}\n\nAction: {y}\n\n"
+                    for (x, y) in self.examples
+                )
+                message = "".join(parts)
                 return message
             else:
                 raise ValueError(
@@ -298,7 +470,7 @@ class ReactPromptConstructor(PromptConstructor):
             )
 
     def get_lm_api_input(
-        self, intro: str, examples: list[tuple[str, str]], current: str
+        self, intro: str, examples: Sequence[tuple[str, str]], current: str
     ) -> APIInput:
 
         """Return the require format for an API"""
@@ -308,9 +480,13 @@ class ReactPromptConstructor(PromptConstructor):
                 message = [{"role": "user", "content": current}]
                 return message
             elif self.lm_config.mode == "completion":
-                message += "Now make thoughts given the observation\n\n"
-                message += f"Observation\n:{current}\n\n"
-                message += "Thought:"
+                message = "".join(
+                    [
+                        "Now make thoughts given the observation\n\n",
+                        f"Observation\n:{current}\n\n",
+                        "Thought:",
+                    ]
+                )
                 return message
             else:
                 raise ValueError(
@@ -321,21 +497,63 @@ class ReactPromptConstructor(PromptConstructor):
                 f"Provider {self.lm_config.provider} not implemented"
             )
 
-    def get_limited_message_history(self):
+    def compress_history(self) -> None:
+        """Drop the thoughts from responses older than `compress_after` steps
+
+        The observation summary and the action of those responses are kept,
+        so older steps stay in the context for longer before truncation has
+        to drop them entirely. Each message is only processed once
+        """
+        # each step starts with a current-state message, so the kept steps
+        # begin at the latest `compress_after` + 1 of them
+        cutoff = len(self.messages)
+        steps = 0
+        while cutoff > self.n_compressed and steps <= self.compress_after:
+            cutoff -= 1
+            msg = self.messages[cutoff]
+            if msg["role"] == "user" and not msg["content"].startswith(
+                "OBSERVATION:"
+            ):
+                steps += 1
+        for i in range(self.n_compressed, cutoff):
+            msg = self.messages[i]
+            if msg["role"] != "assistant":
+                continue
+            content = self._thought_re.sub("", msg["content"])
+            if content == msg["content"]:
+                continue
+            new_msg = {"role": "assistant", "content": content}
+            msg_tokens = self.count_message_tokens(new_msg)
+            self.messages_token_sum -= self.messages_tokens_list[i]
+            self.messages_token_sum += msg_tokens
+            self.messages[i] = new_msg
+            self.messages_tokens_list[i] = msg_tokens
+        self.n_compressed = max(self.n_compressed, cutoff)
+
+    def get_limited_message_history(self) -> list[dict[str, str]]:
         """
         fn to limit history so it can fit context length
         """
-        tot_tokens = self.sys_tokens+self.intent_tokens+self.messages_token_sum+self.lm_config.gen_config["max_tokens"]
-        print(f'total tokens: {tot_tokens} \n')
-        while tot_tokens > self.lm_config.gen_config["context_length"]:
-            print('\n Context limit reached, truncating')
-            self.messages_token_sum -= self.messages_tokens_list[self.msg_start_idx]
-            self.msg_start_idx += 1
-            tot_tokens = self.sys_tokens + self.intent_tokens + self.messages_token_sum + self.lm_config.gen_config[
-                "max_tokens"]
-            print(f'total tokens: {tot_tokens} \n')
-
-        return self.messages[self.msg_start_idx:]
+        fixed_tokens = (
+            self.sys_tokens
+            + self.intent_tokens
+            + self.REPLY_PRIMING_TOKENS
+            + self.lm_config.gen_config["max_tokens"]
+        )
+        budget = self.lm_config.gen_config["context_length"] - fixed_tokens
+        logger.debug(
+            "total tokens: %d", fixed_tokens + self.messages_token_sum
+        )
+        while self.messages_token_sum > budget and self.messages:
+            self.messages_token_sum -= self.messages_tokens_list.popleft()
+            self.messages.popleft()
+            self.n_compressed = max(self.n_compressed - 1, 0)
+            logger.debug(
+                "Context limit reached, truncated to %d tokens",
+                fixed_tokens + self.messages_token_sum,
+            )
+
+        return list(self.messages)
 
     def construct_thought(
         self,
@@ -345,14 +563,11 @@ class ReactPromptConstructor(PromptConstructor):
     ) -> APIInput:
         # intro = self.instruction["intro"]
         # examples = self.instruction["examples"]
-        template = self.instruction["template"]
-        keywords = self.instruction["meta_data"]["keywords"]
+        template = self.template
         state_info: StateInfo = trajectory[-1]  # type: ignore[assignment]
 
         obs = state_info["observation"][self.obs_modality]
-        max_obs_length = self.lm_config.gen_config["max_obs_length"]
-        if max_obs_length:
-            obs = self.tokenizer.decode(self.tokenizer.encode(obs)[:max_obs_length])  # type: ignore[arg-type]
+        obs = self.truncate_observation(obs)  # type: ignore[arg-type]
 
         page = state_info["info"]["page"]
         url = page.url
@@ -366,40 +581,44 @@ class ReactPromptConstructor(PromptConstructor):
             previous_action=self.map_url_to_real(error_msg),
         )
 
-        assert all([f"{{k}}" not in obs for k in keywords])
-        assert all([f"{{k}}" not in current for k in keywords])
-
         # self.messages += self.get_lm_api_input("", [], current)
         # curr_tokens = len(current)/4
         # self.messages_tokens_list.append(curr_tokens)
         # self.messages_token_sum += curr_tokens
 
+        # a different objective means a new task, whose history starts empty
+        if intent != self.objective:
+            self.reset(intent)
         self.add_message(current, "user")
         self.add_message("OBSERVATION: \n" + obs, "user")
+        if self.compress_after:
+            self.compress_history()
 
         prompt = self.sys_prompt + self.intent + self.get_limited_message_history()
 
-        print('prompt \n')
-        for item in prompt:
-            print(item)
-            print('\n')
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("prompt:\n%s", "\n\n".join(map(str, prompt)))
         return prompt
 
-    def add_message(self, msg, role="assistant"):
-        self.messages.append({"role": role, "content": msg})
-        msg_tokens = len(msg) / 4
+    def add_message(self, msg: str, role: str = "assistant") -> None:
+        """Append a message to the history along with its token count"""
+        message = {"role": role, "content": msg}
+        msg_tokens = self.count_message_tokens(message)
+        self.messages.append(message)
         self.messages_tokens_list.append(msg_tokens)
         self.messages_token_sum += msg_tokens
-    def remove_obs(self):
+
+    def remove_obs(self) -> None:
         """
         removes previous observation
         """
+        if not self.messages:
+            return
         prev_msg = self.messages[-1]
         if prev_msg["role"]=="user" and prev_msg["content"].startswith("OBSERVATION:"):
-            print('removing previous observation')
+            logger.debug("removing previous observation")
             self.messages.pop()
-            self.messages_tokens_list.pop()
-            self.messages_token_sum -= len(prev_msg["content"])/4
+            self.messages_token_sum -= self.messages_tokens_list.pop()
     # @beartype
     # def construct(
     #     self,
@@ -415,20 +634,15 @@ class ReactPromptConstructor(PromptConstructor):
     #         print('\n')
     #     return prompt
 
-    @beartype
+    @maybe_beartype
     def _extract_action(self, response: str) -> str:
         # find the first occurence of action
-        print('response\n')
-        print(response)
-        action_splitter = self.instruction["meta_data"]["action_splitter"]
-        pattern = rf"{action_splitter}(.*?){action_splitter}"
-        match = re.search(pattern, response)
-        print('\n matched action \n')
+        logger.debug("response:\n%s", response)
+        match = self._action_re.search(response)
         if match:
-            print(match.group(1))
+            logger.debug("matched action: %s", match.group(1))
             return match.group(1)
         else:
-            print('cannot find answer phrase in response')
             raise ActionParsingError(
                 f'Cannot find the answer phrase "{self.answer_phrase}" in "{response}"'
             )
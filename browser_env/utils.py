@@ -1,12 +1,25 @@
+import os
 from dataclasses import dataclass
 from io import BytesIO
-from typing import Any, Dict, TypedDict, Union
+from typing import Any, Callable, Dict, TypedDict, TypeVar, Union
 
 import numpy as np
 import numpy.typing as npt
 from beartype import beartype
 from PIL import Image
 
+F = TypeVar("F", bound=Callable[..., Any])
+
+
+def maybe_beartype(func: F) -> F:
+    """Type-check a per-step function only when BEARTYPE is set
+
+    Checking every call walks the growing trajectory, so it is opt-in
+    """
+    if __debug__ and os.environ.get("BEARTYPE"):
+        return beartype(func)
+    return func
+
 
 @dataclass
 class DetachedPage:
@@ -2,6 +2,7 @@
 Adopted from https://github.com/zeno-ml/zeno-build/"""
 
 import asyncio
+import contextlib
 import logging
 import os
 import random
@@ -66,8 +67,10 @@ async def _throttled_openai_completion_acreate(
     max_tokens: int,
     top_p: float,
     limiter: aiolimiter.AsyncLimiter,
+    semaphore: asyncio.Semaphore | None = None,
+    stop_token: str | None = None,
 ) -> dict[str, Any]:
-    async with limiter:
+    async with semaphore or contextlib.nullcontext(), limiter:
         for _ in range(3):
             try:
                 return await openai.Completion.acreate(  # type: ignore
@@ -76,6 +79,7 @@ async def _throttled_openai_completion_acreate(
                     temperature=temperature,
                     max_tokens=max_tokens,
                     top_p=top_p,
+                    stop=[stop_token] if stop_token else None,
                 )
             except openai.error.RateLimitError:
                 logging.warning(
@@ -85,7 +89,7 @@ async def _throttled_openai_completion_acreate(
             except openai.error.APIError as e:
                 logging.warning(f"OpenAI API error: {e}")
                 break
-        return {"choices": [{"message": {"content": ""}}]}
+        return {"choices": [{"text": ""}]}
 
 
 async def agenerate_from_openai_completion(
@@ -96,6 +100,9 @@ async def agenerate_from_openai_completion(
     top_p: float,
     context_length: int,
     requests_per_minute: int = 300,
+    max_concurrent_requests: int | None = None,
+    stop_token: str | None = None,
+    show_progress: bool = True,
 ) -> list[str]:
     """Generate from OpenAI Completion API.
 
@@ -106,6 +113,10 @@ async def agenerate_from_openai_completion(
         top_p: Top p to use.
         context_length: Length of context to use.
         requests_per_minute: Number of requests per minute to allow.
+        max_concurrent_requests: Number of requests allowed in flight at
+            once, unbounded if None.
+        stop_token: Token at which to stop generating.
+        show_progress: Whether to display a progress bar.
 
     Returns:
         List of generated responses.
@@ -117,6 +128,11 @@ async def agenerate_from_openai_completion(
     openai.api_key = os.environ["OPENAI_API_KEY"]
 
     limiter = aiolimiter.AsyncLimiter(requests_per_minute)
+    semaphore = (
+        asyncio.Semaphore(max_concurrent_requests)
+        if max_concurrent_requests
+        else None
+    )
     async_responses = [
         _throttled_openai_completion_acreate(
             engine=engine,
@@ -125,10 +141,13 @@ async def agenerate_from_openai_completion(
             max_tokens=max_tokens,
             top_p=top_p,
             limiter=limiter,
+            semaphore=semaphore,
+            stop_token=stop_token,
         )
         for prompt in prompts
     ]
-    responses = await tqdm_asyncio.gather(*async_responses)
+    gather = tqdm_asyncio.gather if show_progress else asyncio.gather
+    responses = await gather(*async_responses)
     return [x["choices"][0]["text"] for x in responses]
 
 
@@ -166,8 +185,10 @@ async def _throttled_openai_chat_completion_acreate(
     max_tokens: int,
     top_p: float,
     limiter: aiolimiter.AsyncLimiter,
+    semaphore: asyncio.Semaphore | None = None,
+    stop_token: str | None = None,
 ) -> dict[str, Any]:
-    async with limiter:
+    async with semaphore or contextlib.nullcontext(), limiter:
         for _ in range(3):
             try:
                 return await openai.ChatCompletion.acreate(  # type: ignore
@@ -176,6 +197,7 @@ async def _throttled_openai_chat_completion_acreate(
                     temperature=temperature,
                     max_tokens=max_tokens,
                     top_p=top_p,
+                    stop=[stop_token] if stop_token else None,
                 )
             except openai.error.RateLimitError:
                 logging.warning(
@@ -199,6 +221,9 @@ async def agenerate_from_openai_chat_completion(
     top_p: float,
     context_length: int,
     requests_per_minute: int = 300,
+    max_concurrent_requests: int | None = None,
+    stop_token: str | None = None,
+    show_progress: bool = True,
 ) -> list[str]:
     """Generate from OpenAI Chat Completion API.
 
@@ -209,6 +234,10 @@ async def agenerate_from_openai_chat_completion(
         top_p: Top p to use.
         context_length: Length of context to use.
         requests_per_minute: Number of requests per minute to allow.
+        max_concurrent_requests: Number of requests allowed in flight at
+            once, unbounded if None.
+        stop_token: Token at which to stop generating.
+        show_progress: Whether to display a progress bar.
 
     Returns:
         List of generated responses.
@@ -220,6 +249,11 @@ async def agenerate_from_openai_chat_completion(
     openai.api_key = os.environ["OPENAI_API_KEY"]
 
     limiter = aiolimiter.AsyncLimiter(requests_per_minute)
+    semaphore = (
+        asyncio.Semaphore(max_concurrent_requests)
+        if max_concurrent_requests
+        else None
+    )
     async_responses = [
         _throttled_openai_chat_completion_acreate(
             model=engine,
@@ -228,10 +262,13 @@ async def agenerate_from_openai_chat_completion(
             max_tokens=max_tokens,
             top_p=top_p,
             limiter=limiter,
+            semaphore=semaphore,
+            stop_token=stop_token,
         )
         for message in messages_list
     ]
-    responses = await tqdm_asyncio.gather(*async_responses)
+    gather = tqdm_asyncio.gather if show_progress else asyncio.gather
+    responses = await gather(*async_responses)
     return [x["choices"][0]["message"]["content"] for x in responses]
 
 
@@ -127,6 +127,18 @@ def config() -> argparse.Namespace:
         help="when not zero, will truncate the observation to this length before feeding to the model",
         default=1920,
     )
+    parser.add_argument(
+        "--response_cache_path",
+        type=str,
+        help="when set, reuse the model response stored in this sqlite file when the exact same prompt is sent again, across runs",
+        default=None,
+    )
+    parser.add_argument(
+        "--compress_history_after",
+        type=int,
+        help="when not zero, drop the thoughts from responses older than this many steps",
+        default=0,
+    )
 
     # example config
     parser.add_argument("--test_start_idx", type=int, default=0)
@@ -0,0 +1,58 @@
+import json
+from pathlib import Path
+
+import pytest
+import tiktoken
+
+from agent.prompts import ReactPromptConstructor
+from agent.prompts.raw import react
+from llms import lm_config
+
+
+@pytest.fixture
+def tokenizer() -> tiktoken.core.Encoding:
+    """A small byte-level BPE that does not need to download a vocabulary"""
+    ranks = {bytes([i]): i for i in range(256)}
+    for pair in [b"  ", b"on", b"bu", b"tt", b"\t\t", b"] "]:
+        ranks[pair] = len(ranks)
+    return tiktoken.Encoding(
+        "test",
+        pat_str=r"""'s|'t|'re|'ve|'m|'ll|'d| ?\p{L}+| ?\p{N}+| ?[^\s\p{L}\p{N}]+|\s+(?!\S)|\s+""",
+        mergeable_ranks=ranks,
+        special_tokens={},
+    )
+
+
+@pytest.fixture
+def react_instruction_path(tmp_path: Path) -> Path:
+    instruction_path = tmp_path / "react.json"
+    with open(instruction_path, "w") as f:
+        json.dump(react.prompt, f)
+    return instruction_path
+
+
+@pytest.fixture
+def llm_config() -> lm_config.LMConfig:
+    llm_config = lm_config.LMConfig(
+        provider="openai", model="gpt-4", mode="chat"
+    )
+    llm_config.gen_config.update(
+        temperature=1.0,
+        top_p=0.9,
+        max_obs_length=100,
+        max_tokens=50,
+        context_length=7000,
+        stop_token=None,
+    )
+    return llm_config
+
+
+@pytest.fixture
+def react_constructor(
+    react_instruction_path: Path,
+    llm_config: lm_config.LMConfig,
+    tokenizer: tiktoken.core.Encoding,
+) -> ReactPromptConstructor:
+    return ReactPromptConstructor(
+        react_instruction_path, lm_config=llm_config, tokenizer=tokenizer
+    )
@@ -0,0 +1,102 @@
+import asyncio
+import re
+from pathlib import Path
+from typing import Any
+
+import openai
+import pytest
+import tiktoken
+
+from agent import ReactPromptAgent, abatch_next_actions
+from agent.prompts import ReactPromptConstructor
+from browser_env import Trajectory
+from browser_env.utils import DetachedPage
+from llms import lm_config
+
+INTENT = "Buy the cheapest fax machine"
+
+
+def make_trajectory(step: int) -> Trajectory:
+    page = DetachedPage(url=f"http://example.com/{step}", content="")
+    return [
+        {
+            "observation": {"text": f"[{step}] button 'Add to Cart'"},
+            "info": {"page": page, "observation_metadata": {}},
+        }
+    ]
+
+
+@pytest.mark.asyncio
+async def test_abatch_next_actions(
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_path: Path,
+    react_instruction_path: Path,
+    llm_config: lm_config.LMConfig,
+    tokenizer: tiktoken.core.Encoding,
+) -> None:
+    n_agents = 5
+    max_concurrent_requests = 2
+    in_flight = 0
+    peak = 0
+    sent: list[list[dict[str, str]]] = []
+
+    async def fake_acreate(
+        messages: list[dict[str, str]], **kwargs: Any
+    ) -> dict[str, Any]:
+        nonlocal in_flight, peak
+        sent.append(messages)
+        in_flight += 1
+        peak = max(peak, in_flight)
+        # answer with the element id of the page the prompt was built from
+        step = re.findall(r"example\.com/(\d+)", messages[-2]["content"])
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        content = f"Thought: click it. Action: `click [{step[0]}]`"
+        return {"choices": [{"message": {"content": content}}]}
+
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    monkeypatch.setattr(openai.ChatCompletion, "acreate", fake_acreate)
+
+    llm_config.gen_config["response_cache_path"] = tmp_path / "cache.db"
+
+    def make_constructor() -> ReactPromptConstructor:
+        return ReactPromptConstructor(
+            react_instruction_path, lm_config=llm_config, tokenizer=tokenizer
+        )
+
+    agents = [
+        ReactPromptAgent(
+            "id_accessibility_tree", llm_config, make_constructor()
+        )
+        for _ in range(n_agents)
+    ]
+    trajectories = [make_trajectory(i) for i in range(n_agents)]
+
+    # the first agent already has a cached answer to its prompt
+    cached_prompt = make_constructor().construct_thought(
+        trajectories[0], INTENT, {"action_history": ["None"]}
+    )
+    agents[0].prompt_constructor.cache_store(
+        cached_prompt, "Action: `click [100]`"
+    )
+
+    actions = await abatch_next_actions(
+        agents,
+        trajectories,
+        [INTENT] * n_agents,
+        [{"action_history": ["None"]}] * n_agents,
+        max_concurrent_requests=max_concurrent_requests,
+    )
+
+    assert peak == max_concurrent_requests
+    assert len(sent) == n_agents - 1
+    assert cached_prompt not in sent
+    assert [a["element_id"] for a in actions] == ["100", "1", "2", "3", "4"]
+    for i, agent in enumerate(agents):
+        response = agent.prompt_constructor.messages[-1]["content"]
+        assert response.endswith(f"`click [{actions[i]['element_id']}]`")
+
+
+@pytest.mark.asyncio
+async def test_abatch_next_actions_without_agents() -> None:
+    assert await abatch_next_actions([], [], [], []) == []
@@ -0,0 +1,182 @@
+from pathlib import Path
+
+import pytest
+import tiktoken
+
+from agent.prompts import ReactPromptConstructor
+from agent.prompts.prompt_constructor import _compile_alternation
+from browser_env import Trajectory
+from browser_env.env_config import URL_MAPPINGS
+from browser_env.utils import DetachedPage
+from llms import lm_config
+
+HTML_OBS = "".join(
+    f"[{i}] button 'Add to Cart'\n\t\t[{i + 1}] StaticText '${i}.49'\n"
+    for i in range(200)
+)
+
+
+@pytest.mark.parametrize("max_tokens", [1, 7, 100, 1000, 10**6])
+@pytest.mark.parametrize("text", ["", "hello", HTML_OBS, "x" * 5000])
+def test_encode_truncated(
+    react_constructor: ReactPromptConstructor,
+    tokenizer: tiktoken.core.Encoding,
+    text: str,
+    max_tokens: int,
+) -> None:
+    tokens = react_constructor.encode_truncated(text, max_tokens)
+    assert tokens == tokenizer.encode_ordinary(text)[:max_tokens]
+    assert text.startswith(tokenizer.decode(tokens))
+
+
+def test_map_url_round_trip(
+    react_constructor: ReactPromptConstructor,
+) -> None:
+    for local, real in URL_MAPPINGS.items():
+        local_url = f"{local}/path?q=1"
+        real_url = f"{real}/path?q=1"
+        assert react_constructor.map_url_to_real(local_url) == real_url
+        assert react_constructor.map_url_to_local(real_url) == local_url
+    # every occurrence is mapped in a single pass
+    text = " ".join(URL_MAPPINGS)
+    assert react_constructor.map_url_to_real(text) == " ".join(
+        URL_MAPPINGS.values()
+    )
+    assert react_constructor.map_url_to_real("no url here") == "no url here"
+
+
+def test_url_alternation_prefers_longest_key() -> None:
+    mapping = {
+        "http://site:7770": "http://shop.com",
+        "http://site:7770/admin": "http://admin.com",
+    }
+    pattern = _compile_alternation(mapping)
+    url = "http://site:7770/admin/orders http://site:7770/cart"
+    mapped = pattern.sub(lambda m: mapping[m.group(0)], url)
+    assert mapped == "http://admin.com/orders http://shop.com/cart"
+
+
+def check_token_bookkeeping(constructor: ReactPromptConstructor) -> None:
+    messages = list(constructor.messages)
+    tokens = list(constructor.messages_tokens_list)
+    assert len(messages) == len(tokens)
+    assert constructor.messages_token_sum == sum(tokens)
+    assert tokens == [constructor.count_message_tokens(m) for m in messages]
+    assert 0 <= constructor.n_compressed <= len(messages)
+
+
+def test_history_token_bookkeeping(
+    react_constructor: ReactPromptConstructor,
+) -> None:
+    constructor = react_constructor
+    constructor.compress_after = 1
+    constructor.reset("Buy the cheapest fax machine")
+    context_length = constructor.lm_config.gen_config["context_length"]
+    for step in range(30):
+        page = DetachedPage(url=f"http://example.com/{step}", content="")
+        trajectory: Trajectory = [
+            {
+                "observation": {"text": HTML_OBS[step:]},
+                "info": {"page": page, "observation_metadata": {}},
+            }
+        ]
+        prompt = constructor.construct_thought(
+            trajectory,
+            "Buy the cheapest fax machine",
+            {"action_history": ["None"]},
+        )
+        check_token_bookkeeping(constructor)
+        assert prompt[-1]["content"].startswith("OBSERVATION:")
+        assert (
+            constructor.sys_tokens
+            + constructor.intent_tokens
+            + constructor.REPLY_PRIMING_TOKENS
+            + constructor.messages_token_sum
+            + constructor.lm_config.gen_config["max_tokens"]
+            <= context_length
+        )
+
+        constructor.remove_obs()
+        check_token_bookkeeping(constructor)
+        constructor.add_message(
+            f"Observation Summary: step {step}. "
+            + "Thought: the button is not loaded yet. " * 10
+            + f"Action: `hover [{step}]`"
+        )
+        check_token_bookkeeping(constructor)
+
+    # older responses lost their thoughts, the latest ones kept them
+    responses = [
+        m["content"] for m in constructor.messages if m["role"] == "assistant"
+    ]
+    assert len(responses) < 30, "the history was never truncated"
+    assert "Thought:" not in responses[0]
+    assert "Thought:" in responses[-1]
+    assert all("Action: `hover" in r for r in responses)
+
+    constructor.reset("Find the restaurants near CMU")
+    check_token_bookkeeping(constructor)
+    assert constructor.messages_token_sum == 0
+
+
+def test_compress_history(react_constructor: ReactPromptConstructor) -> None:
+    constructor = react_constructor
+    constructor.compress_after = 1
+    constructor.reset("Buy the cheapest fax machine")
+    response = (
+        "Observation Summary: the cart page. "
+        "Thought: the previous action: click failed, retry it. "
+        "Action: `click [1]`"
+    )
+    for step in range(3):
+        constructor.add_message(f"URL: http://example.com/{step}", "user")
+        constructor.add_message("OBSERVATION: \n[1] button 'Buy'", "user")
+        constructor.compress_history()
+        constructor.remove_obs()
+        constructor.add_message(response)
+        check_token_bookkeeping(constructor)
+
+    # only the response older than one step lost its whole thought
+    responses = [
+        m["content"] for m in constructor.messages if m["role"] == "assistant"
+    ]
+    assert responses == [
+        "Observation Summary: the cart page. Action: `click [1]`",
+        response,
+        response,
+    ]
+
+
+def test_response_cache(
+    tmp_path: Path,
+    react_instruction_path: Path,
+    llm_config: lm_config.LMConfig,
+    tokenizer: tiktoken.core.Encoding,
+) -> None:
+    prompt = [{"role": "user", "content": "OBSERVATION: [1] button 'Buy'"}]
+    failed_prompt = [{"role": "user", "content": "OBSERVATION: [2] link"}]
+    response = "Thought: buy it. Action: `click [1]`"
+
+    # nothing is cached without a cache file
+    constructor = ReactPromptConstructor(
+        react_instruction_path, lm_config=llm_config, tokenizer=tokenizer
+    )
+    constructor.cache_store(prompt, response)
+    assert constructor.cache_lookup(prompt) is None
+
+    llm_config.gen_config["response_cache_path"] = tmp_path / "cache.db"
+    constructor = ReactPromptConstructor(
+        react_instruction_path, lm_config=llm_config, tokenizer=tokenizer
+    )
+    assert constructor.cache_lookup(prompt) is None
+    constructor.cache_store(prompt, response)
+    # the empty reply of a failed call is not cached
+    constructor.cache_store(failed_prompt, "")
+
+    # a later run reads the responses stored by the previous one
+    constructor = ReactPromptConstructor(
+        react_instruction_path, lm_config=llm_config, tokenizer=tokenizer
+    )
+    assert constructor.cache_lookup(prompt) == response
+    assert constructor.cache_lookup(failed_prompt) is None
+    assert constructor.cache_lookup(prompt + failed_prompt) is None